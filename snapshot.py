@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# snapshot.py -- compact binary snapshots of a Swiss-system tournament
+#
+# A snapshot file holds a tournament state in little-endian fixed-width
+# columns, so it can be memory-mapped and used without parsing:
+#
+#   header     magic 'TSNP', version (uint16), reserved (uint16),
+#              tournament_id, num_of_players, players, matches, byes and
+#              names size (int32 each)
+#   player_ids int32[players]
+#   name_ends  int32[players], the end offset of each name in names
+#   winners    int32[matches]
+#   losers     int32[matches]
+#   byes       int32[byes]
+#   names      the utf-8 encoded player names, back to back
+#
+
+import array
+import ctypes
+import mmap
+import struct
+import sys
+
+import swiss
+
+MAGIC = b'TSNP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHiiiiii')
+
+
+def write_snapshot(path, tournament_id, num_of_players, players, matches,
+                   byes):
+    """Writes a tournament state to a snapshot file.
+
+    Args:
+      path: the snapshot file path.
+      tournament_id: the tournament id.
+      num_of_players: the tournament number of seats.
+      players: a list of (p_id, name) tuples of the tournament players.
+      matches: a list of (winner_id, loser_id) tuples.
+      byes: a list of player ids who received a bye.
+    """
+    names = []
+    name_ends = []
+    end = 0
+    for p_id, name in players:
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        names.append(name)
+        end += len(name)
+        name_ends.append(end)
+    f = open(path, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, tournament_id, num_of_players,
+                            len(players), len(matches), len(byes), end))
+        for column in ([p[0] for p in players], name_ends,
+                       [m[0] for m in matches], [m[1] for m in matches],
+                       byes):
+            _write_column(f, column)
+        f.write(b''.join(names))
+    finally:
+        f.close()
+
+
+def load_snapshot(path):
+    """Loads a snapshot file.
+
+    Args:
+      path: the snapshot file path.
+
+    Returns:
+      snapshot: a Snapshot whose columns are read from the mapped file.
+
+    Raises:
+      ValueError: if the file is not a snapshot of a supported version.
+    """
+    f = open(path, 'rb')
+    try:
+        # A copy-on-write mapping is writable, which ctypes needs to build
+        # views on it, and the file is never modified.
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    finally:
+        f.close()
+    return Snapshot(buf)
+
+
+class Snapshot(object):
+    """A tournament state loaded from a snapshot file.
+
+    The integer columns player_ids, winners, losers and byes are ctypes
+    arrays over the mapped file, so loading does not copy them, on Python 2
+    as well as 3. On big-endian machines they are copied and byte swapped.
+
+    Args:
+      buf: the snapshot file contents, usually an mmap.
+    """
+
+    def __init__(self, buf):
+        if len(buf) < HEADER.size:
+            raise ValueError("not a tournament snapshot")
+        (magic, version, _, self.tournament_id, self.num_of_players,
+         n_players, n_matches, n_byes, names_size) = HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError("not a tournament snapshot")
+        if version != VERSION:
+            raise ValueError(
+                "unsupported snapshot version {0}".format(version))
+        self.buf = buf
+        offset = HEADER.size
+        columns = []
+        for count in (n_players, n_players, n_matches, n_matches, n_byes):
+            columns.append(_read_column(buf, offset, count))
+            offset += 4 * count
+        (self.player_ids, self.name_ends, self.winners, self.losers,
+         self.byes) = columns
+        self.names_offset = offset
+        if len(buf) < offset + names_size:
+            raise ValueError("truncated tournament snapshot")
+
+    def name(self, i):
+        """Returns the name of the i-th player."""
+        start = self.name_ends[i - 1] if i > 0 else 0
+        return bytes(self.buf[self.names_offset + start:
+                              self.names_offset + self.name_ends[i]]
+                     ).decode('utf-8')
+
+    def players(self):
+        """Returns a list of (p_id, name) tuples."""
+        return [(self.player_ids[i], self.name(i))
+                for i in range(len(self.player_ids))]
+
+    def matches(self):
+        """Returns a list of (winner_id, loser_id) tuples."""
+        return list(zip(self.winners, self.losers))
+
+    def standings(self):
+        """Returns the standings, as computed by the standings view.
+
+        Returns:
+          A list of (t_id, p_id, name, wins, matches) tuples, sorted by wins.
+        """
+        return swiss.compute_standings(self.tournament_id, self.players(),
+                                       self.matches(), self.byes)
+
+    def pairings(self):
+        """Returns the next round pairings, as swiss.pair_players() does."""
+        return swiss.pair_players(self.standings(), self.matches(),
+                                  self.byes)
+
+    def close(self):
+        """Releases the snapshot references to the columns and mapped file.
+
+        The file is not unmapped here: each column keeps a reference to the
+        map, which is only freed once no column is referenced any more, so
+        columns kept after close() stay valid.
+        """
+        self.player_ids = self.name_ends = self.winners = None
+        self.losers = self.byes = None
+        self.buf = None
+
+
+def _write_column(f, values):
+    """Writes values to f as little-endian int32."""
+    column = array.array('i', values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    column.tofile(f)
+
+
+def _read_column(buf, offset, count):
+    """Returns count little-endian int32 from buf starting at offset.
+
+    On little-endian machines the column is a ctypes array sharing the
+    memory of buf, which must be writable, and a copy otherwise. A ctypes
+    array made by from_buffer() holds a reference to buf, so buf outlives
+    the column.
+    """
+    end = offset + 4 * count
+    if len(buf) < end:
+        raise ValueError("truncated tournament snapshot")
+    if sys.byteorder == 'little':
+        return (ctypes.c_int32 * count).from_buffer(buf, offset)
+    column = array.array('i', buf[offset:end])
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+#
+# swiss.py -- database free computations of a Swiss-system tournament
+#
+
+import random
+
+
+def number_of_matches(num_of_players):
+    """Finds out the necessary number of swiss pair rounds.
+
+    Args:
+      num_of_players: the number of players in tournament.
+    Returns:
+      num_of_rounds: necessary number of rounds to find winner.
+    """
+    num_of_rounds = 0
+    while 2**num_of_rounds < num_of_players:
+        num_of_rounds += 1
+    return num_of_rounds
+
+
+def played_opponents(matches):
+    """Returns the opponents each player already played.
+
+    Args:
+      matches: a list of (winner_id, loser_id) tuples.
+
+    Returns:
+      opponents: a dict mapping each player id to the set of its opponents.
+    """
+    opponents = {}
+    for winner, loser in matches:
+        opponents.setdefault(winner, set()).add(loser)
+        opponents.setdefault(loser, set()).add(winner)
+    return opponents
+
+
+def compute_standings(tournament_id, players, matches, byes):
+    """Returns the standings, as computed by the standings view.
+
+    Args:
+      tournament_id: the tournament id.
+      players: a list of (p_id, name) tuples of the tournament players.
+      matches: a list of (winner_id, loser_id) tuples.
+      byes: a list of player ids who received a bye.
+
+    Returns:
+      A list of (t_id, p_id, name, wins, matches) tuples, sorted by wins.
+    """
+    wins = dict((p_id, 0) for p_id, name in players)
+    played = dict(wins)
+    for winner, loser in matches:
+        wins[winner] += 1
+        played[winner] += 1
+        played[loser] += 1
+    for p_id in byes:
+        wins[p_id] += 1
+    standings = [(tournament_id, p_id, name, wins[p_id], played[p_id])
+                 for p_id, name in players]
+    standings.sort(key=lambda row: row[3], reverse=True)
+    return standings
+
+
+def omw_standings(standings, matches):
+    """Returns the standings with OMW, as computed by the standings_owm view.
+
+    Args:
+      standings: a list of (t_id, p_id, name, wins, matches) tuples.
+      matches: a list of (winner_id, loser_id) tuples.
+
+    Returns:
+      A list of (t_id, p_id, name, wins, matches, omw) tuples, sorted by
+      wins and OMW.
+    """
+    wins = dict((row[1], row[3]) for row in standings)
+    omw = dict((row[1], 0) for row in standings)
+    for winner, loser in matches:
+        omw[winner] += wins[loser]
+        omw[loser] += wins[winner]
+    ps = [row + (omw[row[1]],) for row in standings]
+    ps.sort(key=lambda row: (row[3], row[5]), reverse=True)
+    return ps
+
+
+def rounds_played(standings, byes):
+    """Returns the number of rounds already played in a tournament.
+
+    Args:
+      standings: a list of (t_id, p_id, name, wins, matches) tuples.
+      byes: a list of player ids who received a bye.
+    """
+    played = dict((row[1], row[4]) for row in standings)
+    for p_id in byes:
+        played[p_id] += 1
+    return max(list(played.values()) + [0])
+
+
+def choose_bye(standings, byes):
+    """Returns the player who gets the bye of the next round, if any.
+
+    The bye goes to a random player in the first bye round, and afterwards
+    to the lowest ranked player who has not received one yet.
+
+    Args:
+      standings: a list of (t_id, p_id, name, wins, matches) tuples, sorted by
+        wins.
+      byes: a list of player ids who already received a bye.
+
+    Returns:
+      bye_player: the (id, name) of the player who gets the bye, or None if
+        the number of players is even.
+    """
+    if len(standings) % 2 == 0:
+        return None
+    have_byes = set(byes)
+    players_ps = list(standings)
+    if len(have_byes) == 0:  # If have_byes is empty, shuffle
+        random.shuffle(players_ps)
+    else:  # Search byes from the end of standings
+        players_ps.reverse()
+    for p in players_ps:
+        if p[1] not in have_byes:
+            return (p[1], p[2])
+    return None
+
+
+def pair_players(standings, matches, byes, bye_player=None):
+    """Returns a list of pairs of players for the next round of a match.
+
+    Each player is paired with another player with an equal or nearly-equal
+    win record, avoiding rematches whenever possible. If there is an odd
+    number of players, one player who has not received a bye yet is left out
+    of the pairings and gets the bye.
+
+    Args:
+      standings: a list of (t_id, p_id, name, wins, matches) tuples, sorted by
+        wins, as returned by player_standings().
+      matches: a list of (winner_id, loser_id) tuples already played in the
+        tournament.
+      byes: a list of player ids who already received a bye.
+      bye_player: the (id, name) of the player who gets the bye, by default
+        the one returned by choose_bye().
+
+    Returns:
+      A dict with the keys:
+        pairs: a list of (id1, name1, id2, name2) tuples.
+        byes: the (id, name) of the player who gets the bye, or None.
+    """
+    opponents = played_opponents(matches)
+    swp = []
+    already_paired = set([])
+    if bye_player is None:
+        bye_player = choose_bye(standings, byes)
+    # Remove bye player, so it is never searched as an opponent
+    ps = [p for p in standings if (p[1], p[2]) != bye_player]
+    by_wins = {}
+    for p in ps:
+        by_wins.setdefault(p[3], set()).add((p[1], p[2]))
+    i = 0
+    while len(swp) < len(ps) // 2:
+        pid = ps[i][1]
+        curr = (ps[i][1], ps[i][2])
+        if curr in already_paired:
+            i += 1
+            continue
+        pairing_group = by_wins[ps[i][3]].difference(already_paired)
+
+        if pairing_group == {curr}:  # Search opponents with one win less
+            pairing_group = by_wins.get(ps[i][3] - 1, set()).union({curr})
+            pairing_group = pairing_group.difference(already_paired)
+
+        if pairing_group == {curr}:  # Search any player still unpaired
+            pairing_group = set((p[1], p[2]) for p in ps)
+            pairing_group = pairing_group.difference(already_paired)
+
+        # Find opponents who already played each other and opponents which
+        # current player already played
+        group_ids = set(p[0] for p in pairing_group)
+        group_ids.discard(pid)
+        pid_played = opponents.get(pid, set())
+        pid_played_pairs = set(
+            p for p in pairing_group if p[0] in pid_played)
+        a_played_pairs = set(
+            p for p in pairing_group if p[0] != pid and
+            len(opponents.get(p[0], set()).intersection(group_ids)) > 0)
+        pairing_group = pairing_group.difference({curr})
+
+        # If current player already played with some opponents, remove them
+        # from the pairing_group
+        if len(pid_played_pairs) > 0:
+            if len(pairing_group.difference(pid_played_pairs)) > 0:
+                pairing_group = pairing_group.difference(pid_played_pairs)
+        # Prefer the opponents who already played each other
+        if len(pairing_group.intersection(a_played_pairs)) > 0:
+            pairing_group = pairing_group.intersection(a_played_pairs)
+
+        pairing_group = list(pairing_group)  # Convert set to list for indexing
+        random.shuffle(pairing_group)  # Shuffle pairing_group
+        opponent = pairing_group[0]
+
+        # Check if players already played, if yes, print message
+        if opponent[0] in pid_played:
+            print("\n-----------------------------------------"
+                  "------------------------>>> "
+                  "Could not avoid {0} and {1} rematch".format(
+                    curr, opponent))
+
+        # Update already paired players
+        already_paired.update([curr, opponent])
+        swp.append((curr[0], curr[1], opponent[0], opponent[1]))
+        i += 1
+    return {'pairs': swp, 'byes': bye_player}
+
+
+def accelerated_pair_players(standings, matches, byes, accelerated_rounds=2):
+    """Returns the pairings for the next round of an Accelerated Swiss.
+
+    In the first accelerated_rounds rounds, the top half of the players by
+    seed, that is by registration order, gets one virtual win, so the
+    strongest players meet each other earlier. Virtual wins only affect the
+    pairings, never the standings, and the bye is chosen before they are
+    added, so it does not depend on them.
+
+    Args:
+      standings: a list of (t_id, p_id, name, wins, matches) tuples.
+      matches: a list of (winner_id, loser_id) tuples.
+      byes: a list of player ids who already received a bye.
+      accelerated_rounds: the number of rounds with virtual wins.
+
+    Returns:
+      The same dict as pair_players().
+    """
+    if rounds_played(standings, byes) >= accelerated_rounds:
+        return pair_players(standings, matches, byes)
+    seeds = sorted(row[1] for row in standings)
+    top_half = set(seeds[:(len(seeds) + 1) // 2])
+    virtual = [row[:3] + (row[3] + int(row[1] in top_half),) + row[4:]
+               for row in standings]
+    virtual.sort(key=lambda row: row[3], reverse=True)
+    return pair_players(virtual, matches, byes, choose_bye(standings, byes))
+
+
+def round_robin_pairings(players, round_number):
+    """Returns the pairings of a round-robin round, by the circle method.
+
+    Every player meets every other player once, in len(players) - 1 rounds,
+    or len(players) rounds with one bye per round if the number of players
+    is odd.
+
+    Args:
+      players: a list of (p_id, name) tuples, in seed order.
+      round_number: the round to pair, starting at 1.
+
+    Returns:
+      The same dict as pair_players(), with no pairs if all rounds have been
+      played.
+    """
+    circle = list(players)
+    if len(circle) % 2 != 0:
+        circle.append(None)
+    if round_number > len(circle) - 1:
+        return {'pairs': [], 'byes': None}
+    shift = (round_number - 1) % max(len(circle) - 1, 1)
+    rest = circle[1:]
+    circle = circle[:1] + rest[len(rest) - shift:] + rest[:len(rest) - shift]
+    swp = []
+    bye_player = None
+    for i in range(len(circle) // 2):
+        p1, p2 = circle[i], circle[-1 - i]
+        if p1 is None or p2 is None:
+            bye_player = p2 if p1 is None else p1
+        else:
+            swp.append((p1[0], p1[1], p2[0], p2[1]))
+    return {'pairs': swp, 'byes': bye_player}
+
+
+def pod_pairings(players, pod_size, round_number):
+    """Returns the pairings of a round of round-robin pods.
+
+    The players are split, in seed order, into pods of pod_size players,
+    the last pod taking the remainder, and each pod plays a round-robin.
+
+    Args:
+      players: a list of (p_id, name) tuples, in seed order.
+      pod_size: the number of players per pod, which must be even, so that
+        at most the last pod gives a bye.
+      round_number: the round to pair, starting at 1.
+
+    Returns:
+      The same dict as pair_players().
+
+    Raises:
+      ValueError: if pod_size is not a positive even number.
+    """
+    if pod_size < 2 or pod_size % 2 != 0:
+        raise ValueError("pod_size must be a positive even number")
+    swp = []
+    bye_player = None
+    for i in range(0, len(players), pod_size):
+        pod = round_robin_pairings(players[i:i + pod_size], round_number)
+        swp.extend(pod['pairs'])
+        if pod['byes'] is not None:
+            bye_player = pod['byes']
+    return {'pairs': swp, 'byes': bye_player}
+
+
+def top_cut_pairings(standings, matches, byes, swiss_rounds, cut, pod_size):
+    """Returns the pairings for the next round of a top cut in pods.
+
+    After swiss_rounds rounds of Swiss, the cut best players by wins and OMW
+    at that point go on to round-robin pods. The Swiss matches are the
+    first ones played, so matches must be in the order they were reported.
+    Byes in the pods are not recorded, as they do not count for the cut.
+
+    Args:
+      standings: a list of (t_id, p_id, name, wins, matches) tuples.
+      matches: a list of (winner_id, loser_id) tuples, in reported order.
+      byes: a list of player ids who received a bye in the Swiss rounds.
+      swiss_rounds: the number of Swiss rounds played before the cut.
+      cut: the number of players who make the cut.
+      pod_size: the number of players per pod.
+
+    Returns:
+      The same dict as pair_players().
+
+    Raises:
+      ValueError: if the Swiss rounds have not all been played yet, or a
+        match after them involves a player outside the cut.
+    """
+    swiss_matches = swiss_rounds * (len(standings) // 2)
+    if len(matches) < swiss_matches:
+        raise ValueError(
+            "the top cut needs {0} Swiss rounds, only {1} of {2} matches "
+            "were played".format(swiss_rounds, len(matches), swiss_matches))
+    players = [(row[1], row[2]) for row in standings]
+    cut_standings = omw_standings(
+        compute_standings(None, players, matches[:swiss_matches], byes),
+        matches[:swiss_matches])
+    seeds = [(row[1], row[2]) for row in cut_standings[:cut]]
+    played = dict((p_id, 0) for p_id, name in seeds)
+    for winner, loser in matches[swiss_matches:]:
+        if winner not in played or loser not in played:
+            raise ValueError("match between {0} and {1} after the Swiss "
+                             "rounds involves a player outside the "
+                             "cut".format(winner, loser))
+        played[winner] += 1
+        played[loser] += 1
+    return pod_pairings(seeds, pod_size, max(list(played.values()) + [0]) + 1)
@@ -3,14 +3,148 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
-import psycopg2
-import bleach
+import gzip
+import numbers
+import os
 import random
+import select
+import time
+
+import snapshot
+import swiss
+from swiss import number_of_matches
+
+# Connection string of the primary database, used for every write.
+WRITE_DSN = os.environ.get('TOURNAMENT_DSN', "dbname=tournament")
+# Connection strings of the read replicas, separated by ';'. Read-only
+# queries are routed to them, falling back to the primary.
+READ_DSNS = [dsn for dsn in os.environ.get(
+    'TOURNAMENT_READ_DSNS', WRITE_DSN).split(';') if dsn.strip()]
+# Maximum replication lag, in seconds, accepted from a replica.
+MAX_REPLICA_LAG = float(os.environ.get('TOURNAMENT_MAX_REPLICA_LAG', 1.0))
+# Seconds to wait for a replica connection before trying the next one.
+REPLICA_CONNECT_TIMEOUT = int(
+    os.environ.get('TOURNAMENT_REPLICA_CONNECT_TIMEOUT', 2))
+# Seconds after a write during which reads stay on the primary, so the
+# session always reads its own writes.
+PRIMARY_PIN_SECONDS = float(
+    os.environ.get('TOURNAMENT_PRIMARY_PIN_SECONDS', 5.0))
+
+# Key space of the per-tournament advisory locks, the first key of the
+# two-key pg_advisory_xact_lock(), so they do not clash with other locks.
+LOCK_NAMESPACE = 0x7453
+
+_last_write = 0.0
+
+
+def connect(read_only=False):
+    """Connect to the PostgreSQL database.  Returns a database connection.
+
+    Writes always go to the primary. Read-only connections go to the first
+    replica, in random order, whose replication lag is within
+    MAX_REPLICA_LAG, unless this process committed a write with
+    _commit_write() less than PRIMARY_PIN_SECONDS ago. A replica that does
+    not answer within REPLICA_CONNECT_TIMEOUT is skipped. If no replica
+    qualifies, the primary is used.
 
+    Args:
+      read_only: if the connection will only be used for reading.
+    """
+    import psycopg2
+    if not read_only:
+        return psycopg2.connect(WRITE_DSN)
+    if time.time() - _last_write < PRIMARY_PIN_SECONDS:
+        return psycopg2.connect(WRITE_DSN)
+    replicas = [dsn for dsn in READ_DSNS if dsn != WRITE_DSN]
+    random.shuffle(replicas)
+    for dsn in replicas:
+        try:
+            conn = psycopg2.connect(dsn,
+                                    connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            continue
+        if _replica_lag(conn) <= MAX_REPLICA_LAG:
+            return conn
+        conn.close()
+    return psycopg2.connect(WRITE_DSN)
+
+
+def _replica_lag(conn):
+    """Returns how many seconds the database behind conn lags the primary.
+
+    A database that is not in recovery is a primary and has no lag, and
+    neither has a replica still streaming from the primary that replayed
+    all the WAL it received, however long ago its last transaction was.
+    Otherwise, as when its WAL receiver is disconnected and it could be
+    arbitrarily stale, the lag is the time since the last replayed
+    transaction. A replica that has not replayed any transaction yet is
+    considered infinitely late.
+
+    Args:
+      conn: an open database connection.
+    """
+    c = conn.cursor()
+    query = "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 " \
+            "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() " \
+            "AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver " \
+            "WHERE status = 'streaming') " \
+            "THEN 0 ELSE extract(" \
+            "epoch FROM now() - pg_last_xact_replay_timestamp()) END;"
+    c.execute(query)
+    lag = c.fetchone()[0]
+    conn.commit()
+    if lag is None:
+        return float('inf')
+    return float(lag)
+
+
+def _commit_write(conn):
+    """Commits a write and pins this process reads to the primary.
+
+    Args:
+      conn: the primary connection the write was made on.
+    """
+    global _last_write
+    conn.commit()
+    _last_write = time.time()
+
+
+def _lock_tournament(c, t_id):
+    """Takes the tournament advisory lock until the transaction ends.
+
+    Args:
+      c: the cursor of the transaction.
+      t_id: the tournament id, already checked by _check_id().
+    """
+    c.execute("SELECT pg_advisory_xact_lock(%s, %s);", (LOCK_NAMESPACE, t_id))
 
-def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+
+def _check_id(value, name='id'):
+    """Returns value as an int, checking it is a positive integer.
+
+    Used for every id passed to a query, instead of sanitizing them as text.
+
+    Args:
+      value: the value to check.
+      name: what value is, used in the error messages.
+
+    Raises:
+      TypeError: if value is not an integer.
+      ValueError: if value is not positive.
+    """
+    if isinstance(value, bool) or not isinstance(value, numbers.Integral):
+        raise TypeError("{0} must be an integer, got {1!r}".format(name,
+                                                                  value))
+    if value < 1:
+        raise ValueError("{0} must be a positive integer, got {1!r}".format(
+            name, value))
+    return int(value)
+
+
+def _clean_name(name):
+    """Returns a player name sanitized by bleach, imported on first use."""
+    import bleach
+    return bleach.clean(name)
 
 
 def delete_matches():
@@ -19,7 +153,7 @@ def delete_matches():
     c = conn.cursor()
     query = "DELETE FROM matches;"
     c.execute(query)
-    conn.commit()
+    _commit_write(conn)
     conn.close()
 
 
@@ -29,7 +163,7 @@ def delete_players():
     c = conn.cursor()
     query = "DELETE FROM players;"
     c.execute(query)
-    conn.commit()
+    _commit_write(conn)
     conn.close()
 
 
@@ -39,7 +173,7 @@ def delete_tournaments():
     c = conn.cursor()
     query = "DELETE FROM tournaments;"
     c.execute(query)
-    conn.commit()
+    _commit_write(conn)
     conn.close()
 
 
@@ -49,7 +183,7 @@ def delete_byes():
     c = conn.cursor()
     query = "DELETE FROM byes;"
     c.execute(query)
-    conn.commit()
+    _commit_write(conn)
     conn.close()
 
 
@@ -59,10 +193,110 @@ def delete_tournament_players():
     c = conn.cursor()
     query = "DELETE FROM tournament_players;"
     c.execute(query)
-    conn.commit()
+    _commit_write(conn)
     conn.close()
 
 
+def reset_database():
+    """Remove all records from every table at once.
+
+    Uses TRUNCATE instead of DELETE, so the tables are emptied in bulk and
+    the serial ids start over from 1.
+    """
+    conn = connect()
+    c = conn.cursor()
+    query = "TRUNCATE matches, byes, tournament_players, tournaments, " \
+            "players RESTART IDENTITY;"
+    c.execute(query)
+    _commit_write(conn)
+    conn.close()
+
+
+def purge_tournament(tournament_id):
+    """Remove a single tournament and all its records from the database.
+
+    The players themselves are kept, as they may take part in other
+    tournaments.
+
+    Args:
+      tournament_id: the tournament id to purge.
+    """
+    tournament_id = _check_id(tournament_id)
+    conn = connect()
+    c = conn.cursor()
+    _purge_tournament(c, tournament_id)
+    _commit_write(conn)
+    conn.close()
+
+
+def archive_tournament(tournament_id, archive_dir):
+    """Move a finished tournament out of the live tables.
+
+    Each table's rows for the tournament are exported in bulk with COPY to a
+    gzip compressed CSV file named tournament_<id>_<table>.csv.gz inside
+    archive_dir, and then purged from the database. Export and purge happen
+    in the same transaction, so nothing is deleted if the export fails. The
+    tournament row is locked first, which makes concurrent inserts of its
+    matches, byes and subscriptions wait until the archive is done, so no
+    row is purged without being exported.
+
+    Args:
+      tournament_id: the tournament id to archive.
+      archive_dir: the directory where the archive files are written.
+
+    Returns:
+      files: the paths of the archive files written.
+    """
+    tournament_id = _check_id(tournament_id)
+    conn = connect()
+    c = conn.cursor()
+    queries = [
+        ('tournaments', "SELECT * FROM tournaments WHERE id = %s"),
+        ('tournament_players', "SELECT * FROM tournament_players "
+                               "WHERE tournament_id = %s"),
+        ('matches', "SELECT * FROM matches WHERE tournament_id = %s"),
+        ('byes', "SELECT * FROM byes WHERE tournament_id = %s"),
+        ('players', "SELECT * FROM players WHERE id IN "
+                    "(SELECT player_id FROM tournament_players "
+                    "WHERE tournament_id = %s)"),
+    ]
+    files = []
+    try:
+        c.execute("SELECT 1 FROM tournaments WHERE id = %s FOR UPDATE;",
+                  (tournament_id,))
+        for table, query in queries:
+            path = os.path.join(
+                archive_dir,
+                "tournament_{0}_{1}.csv.gz".format(tournament_id, table))
+            copy_query = c.mogrify(query, (tournament_id,))
+            f = gzip.open(path, 'wb')
+            try:
+                c.copy_expert("COPY ({0}) TO STDOUT WITH CSV HEADER".format(
+                    copy_query.decode('utf-8')), f)
+            finally:
+                f.close()
+            files.append(path)
+        _purge_tournament(c, tournament_id)
+        _commit_write(conn)
+    finally:
+        conn.close()
+    return files
+
+
+def _purge_tournament(c, t_id):
+    """Delete a tournament's rows using the given cursor, without commit.
+
+    Args:
+      c: the cursor to execute the deletes on.
+      t_id: the tournament id to purge, already checked by _check_id().
+    """
+    c.execute("DELETE FROM matches WHERE tournament_id = %s;", (t_id,))
+    c.execute("DELETE FROM byes WHERE tournament_id = %s;", (t_id,))
+    c.execute("DELETE FROM tournament_players WHERE tournament_id = %s;",
+              (t_id,))
+    c.execute("DELETE FROM tournaments WHERE id = %s;", (t_id,))
+
+
 def count_players():
     """Returns the number of players currently registered."""
     conn = connect()
@@ -81,11 +315,12 @@ def count_tournament_players(tournament_id):
     Args:
       tournament_id: the tournament id to count players.
     """
+    tournament_id = _check_id(tournament_id)
     conn = connect()
     c = conn.cursor()
     query = "SELECT COUNT(id) FROM tournament_players " \
             "WHERE tournament_id = %s;"
-    c.execute(query, (bleach.clean(tournament_id),))
+    c.execute(query, (tournament_id,))
     ctp = [row[0] for row in c.fetchall()]
     conn.commit()
     conn.close()
@@ -104,8 +339,8 @@ def register_player(name):
     conn = connect()
     c = conn.cursor()
     query = "INSERT INTO players (name) VALUES (%s)"
-    c.execute(query, (bleach.clean(name),))
-    conn.commit()
+    c.execute(query, (_clean_name(name),))
+    _commit_write(conn)
     conn.close()
 
 
@@ -116,12 +351,14 @@ def unregister_player(player_id, tournament_id):
       player_id: the player' id.
       tournament_id: the tournament id.
     """
+    player_id = _check_id(player_id)
+    tournament_id = _check_id(tournament_id)
     conn = connect()
     c = conn.cursor()
     query = "DELETE FROM tournament_players " \
             "WHERE player_id = %s AND tournament_id = %s;"
-    c.execute(query, (bleach.clean(player_id), bleach.clean(tournament_id), ))
-    conn.commit()
+    c.execute(query, (player_id, tournament_id, ))
+    _commit_write(conn)
     conn.close()
 
 
@@ -142,10 +379,11 @@ def player_standings(tournament_id):
         wins: the number of matches the player has won
         matches: the number of matches the player has played
     """
-    conn = connect()
+    tournament_id = _check_id(tournament_id)
+    conn = connect(read_only=True)
     c = conn.cursor()
     query = "SELECT * FROM standings WHERE t_id = %s ORDER BY wins DESC;"
-    c.execute(query, (bleach.clean(tournament_id),))
+    c.execute(query, (tournament_id,))
     ps = [(row[0], row[1], row[2], row[3], row[4]) for row in c.fetchall()]
     conn.commit()
     conn.close()
@@ -170,11 +408,12 @@ def player_standings_omw(tournament_id):
         matches: the number of matches the player has played
         omw: the player's opponent match wins
     """
-    conn = connect()
+    tournament_id = _check_id(tournament_id)
+    conn = connect(read_only=True)
     c = conn.cursor()
     query = "SELECT * FROM standings_owm " \
             "WHERE t_id = %s ORDER BY wins DESC, omw DESC;"
-    c.execute(query, (bleach.clean(tournament_id),))
+    c.execute(query, (tournament_id,))
     ps = [(row[0], row[1], row[2], row[3], row[4], row[5])
           for row in c.fetchall()]
     conn.commit()
@@ -190,13 +429,15 @@ def report_match(t_id, winner, loser):
       winner:  the id number of the player who won
       loser:  the id number of the player who lost
     """
+    t_id = _check_id(t_id)
+    winner = _check_id(winner)
+    loser = _check_id(loser)
     conn = connect()
     c = conn.cursor()
     query = "INSERT INTO matches (tournament_id, winner_id, loser_id) " \
             "VALUES (%s, %s, %s)"
-    c.execute(query, (bleach.clean(t_id), bleach.clean(winner),
-                      bleach.clean(loser),))
-    conn.commit()
+    c.execute(query, (t_id, winner, loser,))
+    _commit_write(conn)
     conn.close()
 
 
@@ -207,14 +448,106 @@ def report_bye(t_id, player_id):
       t_id: the tournament id
       player_id: the player's id
     """
+    t_id = _check_id(t_id)
+    player_id = _check_id(player_id)
     conn = connect()
     c = conn.cursor()
     query = "INSERT INTO byes (tournament_id, player_id) VALUES (%s, %s)"
-    c.execute(query, (bleach.clean(t_id), bleach.clean(player_id),))
-    conn.commit()
+    c.execute(query, (t_id, player_id,))
+    _commit_write(conn)
     conn.close()
 
 
+class RoundConflictError(Exception):
+    """Raised when a round was already reported by someone else."""
+
+
+def report_round(tournament_id, round_number, results, bye=None):
+    """Records all the outcomes of a round at once, if still due.
+
+    The round is committed in a single transaction holding a per-tournament
+    advisory lock, so concurrent workers commit rounds one at a time. The
+    round is only recorded if exactly round_number - 1 rounds were played,
+    which rejects a round paired from data that changed meanwhile.
+
+    Args:
+      tournament_id: the tournament id.
+      round_number: the number of the round, starting at 1.
+      results: a list of (winner_id, loser_id) tuples.
+      bye: the id of the player who got the bye, or None.
+
+    Raises:
+      RoundConflictError: if the tournament is no longer at this round.
+    """
+    t_id = _check_id(tournament_id)
+    results = [(_check_id(winner), _check_id(loser))
+               for winner, loser in results]
+    if bye is not None:
+        bye = _check_id(bye)
+    conn = connect()
+    c = conn.cursor()
+    try:
+        _lock_tournament(c, t_id)
+        c.execute("SELECT * FROM standings WHERE t_id = %s;", (t_id,))
+        ps = [(row[0], row[1], row[2], row[3], row[4])
+              for row in c.fetchall()]
+        c.execute("SELECT player_id FROM byes WHERE tournament_id = %s;",
+                  (t_id,))
+        byes = [row[0] for row in c.fetchall()]
+        if swiss.rounds_played(ps, byes) != round_number - 1:
+            raise RoundConflictError(
+                "tournament {0} is not at round {1}".format(t_id,
+                                                            round_number))
+        c.executemany("INSERT INTO matches (tournament_id, winner_id, "
+                      "loser_id) VALUES (%s, %s, %s)",
+                      [(t_id, winner, loser) for winner, loser in results])
+        if bye is not None:
+            c.execute("INSERT INTO byes (tournament_id, player_id) "
+                      "VALUES (%s, %s)", (t_id, bye))
+        _commit_write(conn)
+    finally:
+        conn.close()
+
+
+def play_round(tournament_id, decide, strategy=None, retries=3):
+    """Pairs and records the next round of a tournament.
+
+    Pairing is done without locks and the round is committed with
+    report_round(). If another worker committed the round first, the
+    tournament is paired again from fresh data, up to retries times.
+
+    Args:
+      tournament_id: the tournament id.
+      decide: a function taking a (id1, name1, id2, name2) pair and
+        returning its (winner_id, loser_id).
+      strategy: a function of (standings, matches, byes) returning the
+        pairings dict, by default swiss.pair_players().
+      retries: how many times to pair again after a conflict.
+
+    Returns:
+      The pairings dict of the recorded round.
+
+    Raises:
+      RoundConflictError: if the round could not be recorded after all
+        retries.
+    """
+    if strategy is None:
+        strategy = swiss.pair_players
+    for attempt in range(retries + 1):
+        ps, matches, byes = _pairing_data(tournament_id)
+        pairings = strategy(ps, matches, byes)
+        bye = None
+        if pairings['byes'] is not None:
+            bye = pairings['byes'][0]
+        try:
+            report_round(tournament_id, swiss.rounds_played(ps, byes) + 1,
+                         [decide(pair) for pair in pairings['pairs']], bye)
+            return pairings
+        except RoundConflictError:
+            if attempt == retries:
+                raise
+
+
 def swiss_pairings(tournament_id):
     """Returns a list of pairs of players for the next round of a match.
   
@@ -223,6 +556,12 @@ def swiss_pairings(tournament_id):
     player with an equal or nearly-equal win record, that is, a player adjacent
     to him or her in the standings.
 
+    The standings, matches and byes are read in bulk by _pairing_data(), and
+    the pairing itself is done in memory by swiss.pair_players().
+
+    Pairing takes no lock: workers pairing the same tournament concurrently
+    must use play_round(), which commits each round only once.
+
     Args:
       tournament_id: the tournament id.
 
@@ -233,106 +572,99 @@ def swiss_pairings(tournament_id):
         id2: the second player's unique id
         name2: the second player's name
     """
-    cp = count_tournament_players(tournament_id)
-    swp = []
-    have_byes = set(get_tournament_byes(tournament_id))
-    already_paired = set([])
-    ps = player_standings(tournament_id)
-    bye_player = None
-    if cp % 2 != 0:
-        players_ps = list(ps)
-        if len(have_byes) is 0:  # If have_byes is empty, shuffle
-            random.shuffle(players_ps)
-        else:  # Search in
-            players_ps.reverse()  # Search byes from the end of standings
-        for p in players_ps:
-            if len(have_byes) is 0:  # If have_byes is empty, add
-                bye_player = (p[1], p[2])
-                ps.remove(p)  # Remove bye player
-                break
-            else:  # If have_byes not empty, check if player already have bye
-                if {p[1]}.issubset(have_byes) is False:
-                    bye_player = (p[1], p[2])
-                    ps.remove(p)  # Remove bye player
-                    break
-    i = 0
-    while len(swp) < len(ps)/2:
-        pid = ps[i][1]
-        curr_player = {(ps[i][1], ps[i][2])}
-        if curr_player.issubset(already_paired):
-            i += 1
-            continue
-        pid_opponents = get_player_opponents(pid, tournament_id)
-        pairing_group = curr_player.union(set(pid_opponents))
-        # Remove already paired
-        pairing_group = pairing_group.difference(already_paired)
-
-        if pairing_group == curr_player:
-            pid_opponents = get_player_opponents(pid, tournament_id, False)
-            pairing_group = curr_player.union(set(pid_opponents))
-            # Remove already paired
-            pairing_group = pairing_group.difference(already_paired)
-
-        # Remove bye player from opponents
-        if bye_player is not None:
-            pairing_group = pairing_group.difference({bye_player})
-
-        # Fetch opponents who already played each other and opponents which
-        # current player already played
-        pairing_group_cp = list(pairing_group)
-        a_played_pairs = set([])
-        pid_played_pairs = set([])
-        for pi in list(pairing_group):
-            pairing_group_cp.remove(pi)
-            for pj in pairing_group_cp:
-                if already_played(tournament_id, pi[0], pj[0]):
-                    if pi[0] == pid or pj[0] == pid:
-                        pid_played_pairs = pid_played_pairs.union({pi})
-                        pid_played_pairs = pid_played_pairs.union({pj})
-                    else:
-                        a_played_pairs = a_played_pairs.union({pi})
-                        a_played_pairs = a_played_pairs.union({pj})
-
-        # Remove current player from pairing_group and pid_played_pairs
-        if len(pid_played_pairs) > 0:
-            pid_played_pairs = pid_played_pairs.difference(curr_player)
-        pairing_group = pairing_group.difference(curr_player)
-
-        # If no opponents have played each other and current player already
-        # played with some opponents, remove then from the pairing_group
-        if len(a_played_pairs) == 0:
-            if len(pid_played_pairs) > 0:
-                if len(pairing_group.difference(pid_played_pairs)) > 0:
-                    pairing_group = pairing_group.difference(pid_played_pairs)
-        else:  # If some opponents have already played each other
-            # If current player already played with some opponents, remove
-            # then from the pairing_group
-            if len(pid_played_pairs) > 0:
-                if len(pairing_group.difference(pid_played_pairs)) > 0:
-                    pairing_group = pairing_group.difference(pid_played_pairs)
-            # Else, prefer the opponents who already played each other
-            if len(pairing_group.intersection(a_played_pairs)) > 0:
-                pairing_group = pairing_group.intersection(a_played_pairs)
-
-        pairing_group = list(pairing_group)  # Convert set to list for indexing
-        random.shuffle(pairing_group)  # Shuffle pairing_group
-
-        # Check if players already played, if yes, print message
-        if already_played(tournament_id,
-                          list(curr_player)[0][0], pairing_group[0][0]):
-            print("\n-----------------------------------------"
-                  "------------------------>>> "
-                  "Could not avoid {0} and {1} rematch".format(
-                    list(curr_player)[0], pairing_group[0]))
-
-        # Update already paired players
-        already_paired = already_paired.union(
-                [list(curr_player)[0], pairing_group[0]])
-        swp.append((list(curr_player)[0][0], list(curr_player)[0][1],
-                    pairing_group[0][0], pairing_group[0][1]))
-        i += 1
-    swp_output = {'pairs': swp, 'byes': bye_player}
-    return swp_output
+    return swiss.pair_players(*_pairing_data(tournament_id))
+
+
+def accelerated_swiss_pairings(tournament_id, accelerated_rounds=2):
+    """Returns the pairings for the next round of an Accelerated Swiss.
+
+    Args:
+      tournament_id: the tournament id.
+      accelerated_rounds: the number of first rounds in which the top half
+        of the players by seed gets one virtual win.
+
+    Returns:
+      The same dict as swiss_pairings().
+    """
+    ps, matches, byes = _pairing_data(tournament_id)
+    return swiss.accelerated_pair_players(ps, matches, byes,
+                                          accelerated_rounds)
+
+
+def round_robin_pairings(tournament_id):
+    """Returns the pairings for the next round of a round-robin tournament.
+
+    The players are seeded by registration order, and byes are returned but
+    should not be reported, as every player gets one if the number of
+    players is odd.
+
+    Args:
+      tournament_id: the tournament id.
+
+    Returns:
+      The same dict as swiss_pairings().
+    """
+    ps, matches, byes = _pairing_data(tournament_id)
+    players = sorted((row[1], row[2]) for row in ps)
+    round_number = len(matches) // max(len(players) // 2, 1) + 1
+    return swiss.round_robin_pairings(players, round_number)
+
+
+def top_cut_pairings(tournament_id, cut=8, pod_size=4, swiss_rounds=None):
+    """Returns the pairings for the next round of a top cut in pods.
+
+    After the Swiss rounds, the cut best players by wins and OMW play
+    round-robin pods of pod_size players. Byes in the pods should not be
+    reported.
+
+    Args:
+      tournament_id: the tournament id.
+      cut: the number of players who make the cut.
+      pod_size: the number of players per pod, an even number.
+      swiss_rounds: the number of Swiss rounds before the cut, by default
+        number_of_matches() for the tournament players.
+
+    Returns:
+      The same dict as swiss_pairings().
+    """
+    ps, matches, byes = _pairing_data(tournament_id)
+    if swiss_rounds is None:
+        swiss_rounds = number_of_matches(len(ps))
+    return swiss.top_cut_pairings(ps, matches, byes, swiss_rounds, cut,
+                                  pod_size)
+
+
+def _pairing_data(tournament_id):
+    """Returns what is needed to pair a tournament, read in bulk.
+
+    The standings, matches and byes are read from the primary in a single
+    read-only REPEATABLE READ transaction, so they all come from the same
+    state even while matches are being reported.
+
+    Args:
+      tournament_id: the tournament id.
+
+    Returns:
+      A (standings, matches, byes) tuple:
+        standings: a list of (t_id, p_id, name, wins, matches) tuples.
+        matches: a list of (winner_id, loser_id) tuples, in reported order.
+        byes: a list of player ids who received a bye.
+    """
+    t_id = _check_id(tournament_id)
+    conn = connect()
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    c = conn.cursor()
+    c.execute("SELECT * FROM standings WHERE t_id = %s ORDER BY wins DESC;",
+              (t_id,))
+    ps = [(row[0], row[1], row[2], row[3], row[4]) for row in c.fetchall()]
+    c.execute("SELECT winner_id, loser_id FROM matches "
+              "WHERE tournament_id = %s ORDER BY id;", (t_id,))
+    matches = [(row[0], row[1]) for row in c.fetchall()]
+    c.execute("SELECT player_id FROM byes WHERE tournament_id = %s;", (t_id,))
+    byes = [row[0] for row in c.fetchall()]
+    conn.commit()
+    conn.close()
+    return ps, matches, byes
 
 
 def create_tournament(num_of_players):
@@ -343,11 +675,12 @@ def create_tournament(num_of_players):
     Args:
       num_of_players: the player's full name (need not be unique).
     """
+    num_of_players = _check_id(num_of_players, 'num_of_players')
     conn = connect()
     c = conn.cursor()
     query = "INSERT INTO tournaments (num_of_players) VALUES (%s)"
-    c.execute(query, (bleach.clean(num_of_players),))
-    conn.commit()
+    c.execute(query, (num_of_players,))
+    _commit_write(conn)
     conn.close()
 
 
@@ -361,10 +694,12 @@ def get_player_standings(tournament_id, player_id):
     Returns:
       player_standing: the player standings in the tournament
     """
-    conn = connect()
+    tournament_id = _check_id(tournament_id)
+    player_id = _check_id(player_id)
+    conn = connect(read_only=True)
     c = conn.cursor()
     query = "SELECT * FROM standings WHERE t_id = %s AND p_id = %s;"
-    c.execute(query, (bleach.clean(tournament_id), bleach.clean(player_id),))
+    c.execute(query, (tournament_id, player_id,))
     players_id = [
         (row[0], row[1], row[2], row[3], row[4])
         for row in c.fetchall()
@@ -399,11 +734,12 @@ def get_tournament_players_id(tournament_id):
     Returns:
       players_id: all players id in tournament.
     """
+    tournament_id = _check_id(tournament_id)
     conn = connect()
     c = conn.cursor()
     query = "SELECT player_id " \
             "FROM tournament_players WHERE tournament_id = %s;"
-    c.execute(query, (bleach.clean(tournament_id),))
+    c.execute(query, (tournament_id,))
     players_id = [row[0] for row in c.fetchall()]
     conn.commit()
     conn.close()
@@ -416,7 +752,7 @@ def get_tournaments_id():
     Returns:
       tournaments_id: all tournament ids.
     """
-    conn = connect()
+    conn = connect(read_only=True)
     c = conn.cursor()
     query = "SELECT id FROM tournaments ORDER BY id;"
     c.execute(query)
@@ -435,29 +771,17 @@ def subscribe_player(player_id, tournament_id):
       player_id: the player's id.
       tournament_id: the tournament' id.
     """
+    player_id = _check_id(player_id)
+    tournament_id = _check_id(tournament_id)
     conn = connect()
     c = conn.cursor()
     query = "INSERT INTO tournament_players (player_id, tournament_id) " \
             "VALUES (%s, %s)"
-    c.execute(query, (bleach.clean(player_id), bleach.clean(tournament_id),))
-    conn.commit()
+    c.execute(query, (player_id, tournament_id,))
+    _commit_write(conn)
     conn.close()
 
 
-def number_of_matches(num_of_players):
-    """Finds out the necessary number of swiss pair rounds.
-
-    Args:
-      num_of_players: the number of players in tournament.
-    Returns:
-      num_of_rounds: necessary number of rounds to find winner.
-    """
-    num_of_rounds = 0
-    while 2**num_of_rounds < num_of_players:
-        num_of_rounds += 1
-    return num_of_rounds
-
-
 def get_player_opponents(player_id, tournament_id, same_wins=True):
     """Returns a player's id possible opponents.
 
@@ -469,6 +793,8 @@ def get_player_opponents(player_id, tournament_id, same_wins=True):
     Returns:
       opponents: the player's possible opponents ids.
     """
+    player_id = _check_id(player_id)
+    tournament_id = _check_id(tournament_id)
     conn = connect()
     c = conn.cursor()
     if same_wins is True:
@@ -481,7 +807,7 @@ def get_player_opponents(player_id, tournament_id, same_wins=True):
                 "b.wins FROM standings AS a LEFT JOIN standings AS b " \
                 "ON a.p_id <> b.p_id AND a.t_id = b.t_id " \
                 "WHERE b.wins = a.wins-1 AND a.p_id = %s AND a.t_id = %s;"
-    c.execute(query, (bleach.clean(player_id), bleach.clean(tournament_id),))
+    c.execute(query, (player_id, tournament_id,))
     opponents = [(row[1], row[2]) for row in c.fetchall()]
     conn.commit()
     conn.close()
@@ -512,10 +838,11 @@ def get_tournament_byes(tournament_id):
     Returns:
       byes: all tournament player' ids byes.
     """
+    tournament_id = _check_id(tournament_id)
     conn = connect()
     c = conn.cursor()
     query = "SELECT player_id FROM byes WHERE tournament_id = %s;"
-    c.execute(query, (bleach.clean(tournament_id),))
+    c.execute(query, (tournament_id,))
     byes = [row[0] for row in c.fetchall()]
     conn.commit()
     conn.close()
@@ -533,6 +860,9 @@ def already_played(tournament_id, player1_id, player2_id):
     Returns:
       answer: true if players already played, false otherwise.
     """
+    player1_id = _check_id(player1_id)
+    player2_id = _check_id(player2_id)
+    tournament_id = _check_id(tournament_id)
     conn = connect()
     c = conn.cursor()
     query = "SELECT exists(SELECT * FROM matches " \
@@ -540,9 +870,196 @@ def already_played(tournament_id, player1_id, player2_id):
             "AND tournament_id = %(t)s) " \
         "OR (loser_id = %(p1)s AND winner_id = %(p2)s " \
             "AND tournament_id = %(t)s));"
-    c.execute(query, {'p1': bleach.clean(player1_id), 'p2': player2_id,
+    c.execute(query, {'p1': player1_id, 'p2': player2_id,
                       't': tournament_id})
     answer = [row[0] for row in c.fetchall()]
     conn.commit()
     conn.close()
     return answer[0]
+
+
+def export_snapshot(tournament_id, path):
+    """Writes a tournament state to a binary snapshot file.
+
+    The tournament, its players, matches and byes are read in bulk in a
+    single read-only REPEATABLE READ transaction, so they all come from the
+    same state even while matches are being reported. See snapshot.py for
+    the file format.
+
+    Args:
+      tournament_id: the tournament id.
+      path: the snapshot file path.
+
+    Raises:
+      ValueError: if the tournament does not exist.
+    """
+    t_id = _check_id(tournament_id)
+    conn = connect()
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    c = conn.cursor()
+    c.execute("SELECT num_of_players FROM tournaments WHERE id = %s;",
+              (t_id,))
+    row = c.fetchone()
+    if row is None:
+        conn.close()
+        raise ValueError("tournament {0} does not exist".format(t_id))
+    num_of_players = row[0]
+    c.execute("SELECT players.id, players.name FROM players "
+              "JOIN tournament_players ON players.id = player_id "
+              "WHERE tournament_id = %s ORDER BY players.id;", (t_id,))
+    players = [(row[0], row[1]) for row in c.fetchall()]
+    c.execute("SELECT winner_id, loser_id FROM matches "
+              "WHERE tournament_id = %s ORDER BY id;", (t_id,))
+    matches = [(row[0], row[1]) for row in c.fetchall()]
+    c.execute("SELECT player_id FROM byes WHERE tournament_id = %s;", (t_id,))
+    byes = [row[0] for row in c.fetchall()]
+    conn.commit()
+    conn.close()
+    snapshot.write_snapshot(path, t_id, num_of_players, players, matches,
+                            byes)
+
+
+def import_snapshot(path):
+    """Loads a snapshot file into the database as a new tournament.
+
+    The snapshot players are registered as new players, so the tournament
+    and player ids are assigned by the database and differ from the
+    snapshot's. The new player ids are reserved from the players sequence
+    before the insert, so each snapshot player is mapped to its new id
+    whatever order the rows are inserted in.
+    Everything is inserted in a single transaction.
+
+    Args:
+      path: the snapshot file path.
+
+    Returns:
+      tournament_id: the id of the new tournament.
+    """
+    from psycopg2.extras import execute_values
+    snap = snapshot.load_snapshot(path)
+    try:
+        players = snap.players()
+        matches = snap.matches()
+        byes = list(snap.byes)
+        num_of_players = snap.num_of_players
+    finally:
+        snap.close()
+    conn = connect()
+    c = conn.cursor()
+    c.execute("INSERT INTO tournaments (num_of_players) VALUES (%s) "
+              "RETURNING id;", (num_of_players,))
+    t_id = c.fetchone()[0]
+    c.execute("SELECT nextval('players_id_seq') "
+              "FROM generate_series(1, %s);", (len(players),))
+    ids = dict((p[0], row[0]) for p, row in zip(players, c.fetchall()))
+    execute_values(
+        c, "INSERT INTO players (id, name) VALUES %s;",
+        [(ids[p_id], name) for p_id, name in players])
+    execute_values(
+        c, "INSERT INTO tournament_players (player_id, tournament_id) "
+           "VALUES %s;", [(ids[p_id], t_id) for p_id, name in players])
+    execute_values(
+        c, "INSERT INTO matches (tournament_id, winner_id, loser_id) "
+           "VALUES %s;", [(t_id, ids[w], ids[l]) for w, l in matches])
+    execute_values(
+        c, "INSERT INTO byes (tournament_id, player_id) VALUES %s;",
+        [(t_id, ids[p_id]) for p_id in byes])
+    _commit_write(conn)
+    conn.close()
+    return t_id
+
+
+class StandingsSubscriber(object):
+    """Delivers standings changes pushed by the database.
+
+    The tournament.sql triggers NOTIFY the 'standings' channel with the
+    tournament id whenever its matches, byes or players change. The
+    subscriber LISTENs on a single connection to the primary and, for each
+    changed tournament, reads the standings with OMW once and reports only
+    the players whose wins, matches or OMW changed, or who joined or left.
+
+    The deltas are dicts mapping each changed player id to an
+    (old_row, new_row) tuple of player_standings_omw() rows. old_row is None
+    the first time a player is seen, and new_row is None once a player is
+    no longer in the standings, as after unregister_player() or when the
+    tournament is purged.
+
+    Args:
+      tournament_ids: the tournament ids to watch, or None to watch all.
+    """
+
+    def __init__(self, tournament_ids=None):
+        import psycopg2.extensions
+        self.tournament_ids = None
+        if tournament_ids is not None:
+            self.tournament_ids = set(_check_id(t) for t in tournament_ids)
+        self.conn = psycopg2.connect(WRITE_DSN)
+        self.conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        self.standings = {}
+        c = self.conn.cursor()
+        c.execute("LISTEN standings;")
+        if self.tournament_ids is not None:
+            for t_id in self.tournament_ids:
+                self._changes(t_id)
+
+    def poll(self, timeout=None):
+        """Waits for standings changes.
+
+        Args:
+          timeout: the maximum seconds to wait, or None to wait forever.
+
+        Returns:
+          changes: a list of (tournament_id, delta) tuples, empty if nothing
+            changed before the timeout.
+        """
+        # Notifications may already have been received while _changes() ran
+        # its queries, so only wait on the socket when none are pending.
+        if not self.conn.notifies:
+            if select.select([self.conn], [], [], timeout) == ([], [], []):
+                return []
+            self.conn.poll()
+        changed = set()
+        while self.conn.notifies:
+            t_id = int(self.conn.notifies.pop(0).payload)
+            if self.tournament_ids is None or t_id in self.tournament_ids:
+                changed.add(t_id)
+        changes = []
+        for t_id in sorted(changed):
+            delta = self._changes(t_id)
+            if delta:
+                changes.append((t_id, delta))
+        return changes
+
+    def __iter__(self):
+        while True:
+            for change in self.poll():
+                yield change
+
+    def listen(self, callback):
+        """Calls callback(tournament_id, delta) for every change, forever.
+
+        Args:
+          callback: the function called with each change.
+        """
+        for t_id, delta in self:
+            callback(t_id, delta)
+
+    def close(self):
+        """Closes the listening connection."""
+        self.conn.close()
+
+    def _changes(self, tournament_id):
+        """Reads a tournament standings and returns what changed."""
+        c = self.conn.cursor()
+        query = "SELECT * FROM standings_owm WHERE t_id = %s;"
+        c.execute(query, (tournament_id,))
+        new = dict((row[1], tuple(row)) for row in c.fetchall())
+        old = self.standings.get(tournament_id, {})
+        self.standings[tournament_id] = new
+        delta = dict((p_id, (old.get(p_id), row))
+                     for p_id, row in new.items() if old.get(p_id) != row)
+        for p_id, row in old.items():
+            if p_id not in new:
+                delta[p_id] = (row, None)
+        return delta
@@ -134,6 +134,10 @@ DECLARE
   subscribed_players INTEGER;
   num_players INTEGER;
 BEGIN
+  -- Lock the tournament row, so concurrent subscriptions are counted one at
+  -- a time and cannot overfill the tournament
+  PERFORM 1 FROM tournaments
+    WHERE tournaments.id = NEW.tournament_id FOR NO KEY UPDATE;
   subscribed_players := (SELECT count(player_id)
                          FROM tournament_players
                          WHERE tournament_id = NEW.tournament_id);
@@ -172,4 +176,34 @@ CREATE TRIGGER check_player_match_trg
     BEFORE INSERT OR UPDATE
     ON byes
     FOR EACH ROW
-    EXECUTE PROCEDURE check_player_bye();
\ No newline at end of file
+    EXECUTE PROCEDURE check_player_bye();
+
+-- Trigger to notify listeners that a tournament standings changed
+CREATE FUNCTION notify_standings() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM pg_notify('standings', OLD.tournament_id::text);
+  ELSE
+    PERFORM pg_notify('standings', NEW.tournament_id::text);
+  END IF;
+  RETURN NULL;
+END;
+$$ language plpgsql;
+
+CREATE TRIGGER notify_standings_trg
+    AFTER INSERT OR UPDATE OR DELETE
+    ON matches
+    FOR EACH ROW
+    EXECUTE PROCEDURE notify_standings();
+
+CREATE TRIGGER notify_standings_trg
+    AFTER INSERT OR UPDATE OR DELETE
+    ON byes
+    FOR EACH ROW
+    EXECUTE PROCEDURE notify_standings();
+
+CREATE TRIGGER notify_standings_trg
+    AFTER INSERT OR UPDATE OR DELETE
+    ON tournament_players
+    FOR EACH ROW
+    EXECUTE PROCEDURE notify_standings();
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Benchmarks for tournament.py
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+
+def time_import(module, repeat=5):
+    """Returns the best wall time, in ms, to import module in a new python.
+
+    The time of starting an interpreter that imports nothing is subtracted.
+    """
+    devnull = open(os.devnull, 'w')
+
+    def run(code):
+        return min(timeit.repeat(
+            lambda: subprocess.check_call([sys.executable, '-c', code],
+                                          stderr=devnull),
+            number=1, repeat=repeat))
+    try:
+        baseline = run('pass')
+        return (run('import {}'.format(module)) - baseline) * 1000
+    finally:
+        devnull.close()
+
+
+def bench_import():
+    print("{0:_^24}|{1:_^12}".format('import', 'ms'))
+    for module in ['swiss', 'tournament', 'psycopg2', 'bleach']:
+        try:
+            ms = "{:.1f}".format(time_import(module))
+        except subprocess.CalledProcessError:
+            ms = 'n/a'
+        print("{0:^24}|{1:^12}".format(module, ms))
+
+
+def bench_validation(number=100000):
+    import tournament
+    print("{0:_^24}|{1:_^12}".format('id validation', 'us/call'))
+    checks = [('_check_id', tournament._check_id)]
+    try:
+        import bleach
+        checks.append(('bleach.clean', lambda v: bleach.clean(str(v))))
+    except ImportError:
+        pass
+    for name, check in checks:
+        us = timeit.timeit(lambda: check(12345), number=number) / number
+        print("{0:^24}|{1:^12.3f}".format(name, us * 1e6))
+
+
+def bench_snapshot(num_of_players=10000, rounds=14):
+    import snapshot
+    print("{0:_^24}|{1:_^12}".format(
+        'snapshot {} players'.format(num_of_players), 'ms'))
+    players = [(i + 1, "Player {}".format(i + 1))
+               for i in range(num_of_players)]
+    matches = [tuple(random.sample(range(1, num_of_players + 1), 2))
+               for i in range(rounds * num_of_players // 2)]
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(snapshot_dir, 'tournament.snap')
+        snapshot.write_snapshot(path, 1, num_of_players, players, matches,
+                                [])
+        snaps = []
+        ms = timeit.timeit(lambda: snaps.append(snapshot.load_snapshot(path)),
+                           number=100) * 10
+        print("{0:^24}|{1:^12.3f}".format('load', ms))
+        ms = timeit.timeit(snaps[0].standings, number=10) * 100
+        print("{0:^24}|{1:^12.3f}".format('standings', ms))
+        for snap in snaps:
+            snap.close()
+    finally:
+        shutil.rmtree(snapshot_dir)
+
+
+def bench_formats(num_of_players=1001):
+    import swiss
+    print("{0:_^24}|{1:_^12}".format(
+        'format {} players'.format(num_of_players), 'ms/round'))
+    players = [(i + 1, "Player {}".format(i + 1))
+               for i in range(num_of_players)]
+    num_of_rounds = swiss.number_of_matches(num_of_players)
+    for name, pair in [('swiss', swiss.pair_players),
+                       ('accelerated swiss', swiss.accelerated_pair_players)]:
+        matches = []
+        byes = []
+        elapsed = 0
+        for r in range(num_of_rounds):
+            standings = swiss.compute_standings(1, players, matches, byes)
+            start = timeit.default_timer()
+            pairings = pair(standings, matches, byes)
+            elapsed += timeit.default_timer() - start
+            for p1, name1, p2, name2 in pairings['pairs']:
+                matches.append(random.choice([(p1, p2), (p2, p1)]))
+            if pairings['byes'] is not None:
+                byes.append(pairings['byes'][0])
+        print("{0:^24}|{1:^12.3f}".format(
+            name, elapsed / num_of_rounds * 1000))
+    standings = swiss.compute_standings(1, players, matches, byes)
+    for name, pair in [
+            ('round robin', lambda: swiss.round_robin_pairings(
+                players, num_of_players // 2)),
+            ('pods of 8', lambda: swiss.pod_pairings(players, 8, 4)),
+            ('top cut 64 in pods', lambda: swiss.top_cut_pairings(
+                standings, matches, byes, num_of_rounds, 64, 8))]:
+        ms = timeit.timeit(pair, number=10) * 100
+        print("{0:^24}|{1:^12.3f}".format(name, ms))
+
+
+if __name__ == '__main__':
+    bench_import()
+    bench_validation()
+    bench_snapshot()
+    bench_formats()
@@ -2,6 +2,16 @@
 #
 # Test cases for tournament.py
 
+import gzip
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+
+import snapshot
+import swiss
+import tournament
 from tournament import *
 
 
@@ -271,6 +281,383 @@ def test_new_database():
 
     print "9. Tests with 4, 6, 8, 9, 16, 17 and 18 number of players passed."
 
+
+def test_archive_tournament():
+    reset_database()
+    register_player("Twilight Sparkle")
+    register_player("Fluttershy")
+    create_tournament(num_of_players=2)
+    create_tournament(num_of_players=2)
+    players_ids = get_players_id()
+    reg_tournaments = get_tournaments_id()
+    for t_id in reg_tournaments:
+        for p_id in players_ids:
+            subscribe_player(p_id, t_id)
+        report_match(t_id, players_ids[0], players_ids[1])
+
+    archive_dir = tempfile.mkdtemp()
+    try:
+        files = archive_tournament(reg_tournaments[0], archive_dir)
+        if len(files) != 5:
+            raise ValueError("archive_tournament should write one archive "
+                             "file per table.")
+        matches_file = os.path.join(
+            archive_dir,
+            "tournament_{0}_matches.csv.gz".format(reg_tournaments[0]))
+        f = gzip.open(matches_file, 'rb')
+        lines = f.read().splitlines()
+        f.close()
+        if len(lines) != 2:
+            raise ValueError("Archived matches should contain a header and "
+                             "the tournament's single match.")
+    finally:
+        shutil.rmtree(archive_dir)
+    if get_tournaments_id() != reg_tournaments[1:]:
+        raise ValueError("Only the archived tournament should be purged.")
+    if len(player_standings(reg_tournaments[1])) != 2:
+        raise ValueError("Other tournaments should keep their standings.")
+    if count_players() != 2:
+        raise ValueError("Archiving a tournament should keep its players.")
+
+    purge_tournament(reg_tournaments[1])
+    if get_tournaments_id() != []:
+        raise ValueError("After purging, no tournament should remain.")
+    reset_database()
+    if count_players() != 0:
+        raise ValueError("After reset, count_players should return zero.")
+    print "10. Tournaments can be archived, purged and reset."
+
+
+def test_read_replica_routing():
+    reset_database()
+    create_tournament(num_of_players=2)
+    read_dsns = tournament.READ_DSNS
+    max_replica_lag = tournament.MAX_REPLICA_LAG
+    tournament.READ_DSNS = ["dbname=tournament_missing_replica"]
+    try:
+        conn = connect(read_only=True)
+        dsn = conn.dsn
+        conn.close()
+        if dsn != tournament.WRITE_DSN:
+            raise ValueError("Reads right after a write should be pinned "
+                             "to the primary.")
+        tournament._last_write = 0.0
+        if len(get_tournaments_id()) != 1:
+            raise ValueError("Reads should fall back to the primary when no "
+                             "replica is available.")
+
+        # The primary under an alias stands for a healthy replica.
+        tournament.READ_DSNS = [tournament.WRITE_DSN +
+                                " application_name=tournament_replica"]
+        for max_lag, expected in [(1.0, "tournament_replica"), (-1.0, "")]:
+            tournament.MAX_REPLICA_LAG = max_lag
+            conn = connect(read_only=True)
+            c = conn.cursor()
+            c.execute("SHOW application_name;")
+            application_name = c.fetchone()[0]
+            conn.close()
+            if application_name != expected:
+                raise ValueError("Replicas should be used only within "
+                                 "MAX_REPLICA_LAG.")
+    finally:
+        tournament.READ_DSNS = read_dsns
+        tournament.MAX_REPLICA_LAG = max_replica_lag
+    print "11. Reads are routed to replicas or pinned to the primary."
+
+
+def test_id_validation():
+    for bad_id in ["1", 1.0, None]:
+        try:
+            player_standings(bad_id)
+        except TypeError:
+            pass
+        else:
+            raise ValueError("Non integer ids should raise TypeError.")
+    last_write = tournament._last_write
+    try:
+        report_bye(0, 1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Non positive ids should raise ValueError.")
+    if tournament._last_write != last_write:
+        raise ValueError("Rejected writes should not pin reads to the "
+                         "primary.")
+    try:
+        create_tournament(num_of_players="4")
+    except TypeError:
+        pass
+    else:
+        raise ValueError("Non integer seat counts should raise TypeError.")
+    print "12. Ids are validated as positive integers."
+
+
+def test_standings_subscriber():
+    reset_database()
+    register_player("Bruno Walton")
+    register_player("Boots O'Neal")
+    register_player("Cathy Burton")
+    create_tournament(num_of_players=3)
+    players_ids = get_players_id()
+    reg_tournaments = get_tournaments_id()
+    for p_id in players_ids:
+        subscribe_player(p_id, reg_tournaments[-1])
+
+    subscriber = StandingsSubscriber([reg_tournaments[-1]])
+    try:
+        report_match(reg_tournaments[-1], players_ids[0], players_ids[1])
+        changes = subscriber.poll(timeout=5)
+        if [t_id for t_id, delta in changes] != [reg_tournaments[-1]]:
+            raise ValueError("A reported match should notify its tournament.")
+        delta = changes[0][1]
+        if set(delta) != set(players_ids[:2]):
+            raise ValueError("Only the match players should have changed.")
+        if delta[players_ids[0]][1][3] != 1:
+            raise ValueError("The delta should carry the winner's new wins.")
+        report_bye(reg_tournaments[-1], players_ids[2])
+        changes = subscriber.poll(timeout=5)
+        if set(changes[0][1]) != set([players_ids[2]]):
+            raise ValueError("A reported bye should notify its player.")
+
+        # Back to back reports, the second one possibly received while the
+        # first one's standings are read, must both be delivered.
+        report_match(reg_tournaments[-1], players_ids[1], players_ids[2])
+        report_match(reg_tournaments[-1], players_ids[2], players_ids[0])
+        changed = set()
+        while changed != set(players_ids):
+            changes = subscriber.poll(timeout=5)
+            if not changes:
+                raise ValueError("Back to back reports should all be "
+                                 "delivered.")
+            for t_id, delta in changes:
+                changed.update(delta)
+
+        unregister_player(players_ids[2], reg_tournaments[-1])
+        changes = subscriber.poll(timeout=5)
+        delta = changes[0][1] if changes else {}
+        if players_ids[2] not in delta or delta[players_ids[2]][1] is not None:
+            raise ValueError("An unregistered player should be reported as "
+                             "removed.")
+        purge_tournament(reg_tournaments[-1])
+        changes = subscriber.poll(timeout=5)
+        delta = changes[0][1] if changes else {}
+        if set(delta) != set(players_ids[:2]) or \
+                [new_row for old_row, new_row in delta.values()] != [None] * 2:
+            raise ValueError("A purged tournament's players should be "
+                             "reported as removed.")
+    finally:
+        subscriber.close()
+    print "13. Standings changes are pushed to subscribers."
+
+
+def test_snapshot():
+    reset_database()
+    register_player("Twilight Sparkle")
+    register_player("Fluttershy")
+    register_player("Applejack")
+    create_tournament(num_of_players=3)
+    players_ids = get_players_id()
+    reg_tournaments = get_tournaments_id()
+    for p_id in players_ids:
+        subscribe_player(p_id, reg_tournaments[-1])
+    report_match(reg_tournaments[-1], players_ids[0], players_ids[1])
+    report_bye(reg_tournaments[-1], players_ids[2])
+
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(snapshot_dir, 'tournament.snap')
+        export_snapshot(reg_tournaments[-1], path)
+        snap = snapshot.load_snapshot(path)
+        standings = sorted(player_standings(reg_tournaments[-1]))
+        if sorted(snap.standings()) != standings:
+            raise ValueError("Snapshot standings should match the database.")
+        winners = snap.winners
+        snap.close()
+        if list(winners) != [players_ids[0]]:
+            raise ValueError("Columns kept after close() should stay "
+                             "readable.")
+        t_id = import_snapshot(path)
+        try:
+            export_snapshot(t_id + 1, path)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("Exporting a missing tournament should raise "
+                             "ValueError.")
+    finally:
+        shutil.rmtree(snapshot_dir)
+    imported = [row[2:] for row in player_standings(t_id)]
+    if sorted(imported) != sorted([row[2:] for row in standings]):
+        raise ValueError("Imported standings should match the snapshot.")
+    print "14. Tournaments can be exported to and imported from snapshots."
+
+
+def test_formats():
+    reset_database()
+    register_player("Twilight Sparkle")
+    register_player("Fluttershy")
+    register_player("Applejack")
+    register_player("Pinkie Pie")
+    create_tournament(num_of_players=4)
+    players_ids = get_players_id()
+    reg_tournaments = get_tournaments_id()
+    for p_id in players_ids:
+        subscribe_player(p_id, reg_tournaments[-1])
+
+    pairings = accelerated_swiss_pairings(reg_tournaments[-1])
+    actual_pairs = set([frozenset([p[0], p[2]]) for p in pairings['pairs']])
+    if frozenset(sorted(players_ids)[:2]) not in actual_pairs:
+        raise ValueError("In the first accelerated round, the top seeds "
+                         "should be paired together.")
+
+    played = set([])
+    for match in range(3):
+        pairings = round_robin_pairings(reg_tournaments[-1])
+        if len(pairings['pairs']) != 2:
+            raise ValueError("For four players, round_robin_pairings should "
+                             "return two pairs.")
+        for pair in pairings['pairs']:
+            played.add(frozenset([pair[0], pair[2]]))
+            report_match(reg_tournaments[-1], pair[0], pair[2])
+    if len(played) != 6:
+        raise ValueError("In a round-robin, every player should meet every "
+                         "other player once.")
+    if round_robin_pairings(reg_tournaments[-1])['pairs'] != []:
+        raise ValueError("After all rounds, round_robin_pairings should "
+                         "return no pairs.")
+
+    pairings = top_cut_pairings(reg_tournaments[-1], cut=2, pod_size=2,
+                                swiss_rounds=3)
+    standings = player_standings_omw(reg_tournaments[-1])
+    if len(pairings['pairs']) != 1 or \
+            standings[0][1] not in pairings['pairs'][0][::2]:
+        raise ValueError("The top cut should pair the best players.")
+    try:
+        top_cut_pairings(reg_tournaments[-1], cut=2, pod_size=2,
+                         swiss_rounds=4)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A top cut before the Swiss rounds are played "
+                         "should raise ValueError.")
+
+    create_tournament(num_of_players=7)
+    for i in range(3):
+        register_player("Player {}".format(i + 1))
+    players_ids = get_players_id()
+    reg_tournaments = get_tournaments_id()
+    for p_id in players_ids:
+        subscribe_player(p_id, reg_tournaments[-1])
+    byes = []
+    for match in range(number_of_matches(7)):
+        pairings = accelerated_swiss_pairings(reg_tournaments[-1])
+        if len(pairings['pairs']) != 3 or pairings['byes'] is None:
+            raise ValueError("For seven players, accelerated_swiss_pairings "
+                             "should return three pairs and a bye.")
+        if pairings['byes'][0] in byes:
+            raise ValueError("The same player should not receive more than "
+                             "one bye per tournament.")
+        for pair in pairings['pairs']:
+            decide_match(reg_tournaments[-1], pair[0], pair[2])
+        report_bye(reg_tournaments[-1], pairings['byes'][0])
+        byes.append(pairings['byes'][0])
+    print "15. Accelerated Swiss, round-robin and top cut pairings work."
+
+
+def subscribe_worker(args):
+    try:
+        subscribe_player(*args)
+    except Exception:
+        return False
+    return True
+
+
+def play_rounds_worker(args):
+    tournament_id, num_of_rounds = args
+    played = 0
+    while True:
+        ps = player_standings(tournament_id)
+        if max([row[4] for row in ps]) >= num_of_rounds:
+            return played
+        try:
+            play_round(tournament_id,
+                       lambda pair: random.choice([(pair[0], pair[2]),
+                                                   (pair[2], pair[0])]))
+            played += 1
+        except RoundConflictError:
+            pass
+
+
+def test_concurrency():
+    reset_database()
+    for i in range(16):
+        register_player("Player {}".format(i + 1))
+    create_tournament(num_of_players=8)
+    players_ids = get_players_id()
+    reg_tournaments = get_tournaments_id()
+    pool = multiprocessing.Pool(8)
+    try:
+        subscribed = pool.map(subscribe_worker, [(p_id, reg_tournaments[-1])
+                                                 for p_id in players_ids])
+        if sum(subscribed) != 8 or \
+                count_tournament_players(reg_tournaments[-1]) != 8:
+            raise ValueError("Concurrent subscriptions should not overfill "
+                             "the tournament.")
+
+        n_rounds = number_of_matches(8)
+        played = pool.map(play_rounds_worker,
+                          [(reg_tournaments[-1], n_rounds)] * 8)
+    finally:
+        pool.close()
+        pool.join()
+    if sum(played) != n_rounds:
+        raise ValueError("Each round should be recorded by one worker only.")
+    for row in player_standings(reg_tournaments[-1]):
+        if row[4] != n_rounds:
+            raise ValueError("Each player should play once per round.")
+    print "16. Concurrent subscriptions and rounds keep the invariants."
+
+
+def test_swiss():
+    players = [(i + 1, "Player {}".format(i + 1)) for i in range(5)]
+
+    standings = swiss.compute_standings(1, players[:4], [], [])
+    pairings = swiss.pair_players(standings, [], [])
+    paired = [p[0] for p in pairings['pairs']] + \
+        [p[2] for p in pairings['pairs']]
+    if sorted(paired) != [1, 2, 3, 4] or pairings['byes'] is not None:
+        raise ValueError("For an even number of players, each player should "
+                         "be paired once and none should get a bye.")
+    matches = [(1, 2), (3, 4)]
+    standings = swiss.compute_standings(1, players[:4], matches, [])
+    pairings = swiss.pair_players(standings, matches, [])
+    actual_pairs = set([frozenset([p[0], p[2]]) for p in pairings['pairs']])
+    if actual_pairs != set([frozenset([1, 3]), frozenset([2, 4])]):
+        raise ValueError("Players with equal wins should be paired, "
+                         "avoiding rematches.")
+
+    matches = []
+    byes = []
+    for match in range(swiss.number_of_matches(5)):
+        standings = swiss.compute_standings(1, players, matches, byes)
+        pairings = swiss.pair_players(standings, matches, byes)
+        if len(pairings['pairs']) != 2 or pairings['byes'] is None:
+            raise ValueError("For five players, pair_players should return "
+                             "two pairs and a bye.")
+        if pairings['byes'][0] in byes:
+            raise ValueError("The same player should not receive more than "
+                             "one bye per tournament.")
+        matches.extend((p[0], p[2]) for p in pairings['pairs'])
+        byes.append(pairings['byes'][0])
+
+    standings = swiss.compute_standings(1, players[:2], [(1, 2)], [])
+    pairings = swiss.pair_players(standings, [(1, 2)], [])
+    if [(p[0], p[2]) for p in pairings['pairs']] not in [[(1, 2)], [(2, 1)]]:
+        raise ValueError("When a rematch cannot be avoided, the players "
+                         "should still be paired.")
+    print "17. Swiss pairing works without a database."
+
+
 if __name__ == '__main__':
     test_delete_matches()
     test_delete()
@@ -282,6 +669,14 @@ if __name__ == '__main__':
     test_pairings()
     # Custom tests
     test_new_database()
+    test_archive_tournament()
+    test_read_replica_routing()
+    test_id_validation()
+    test_standings_subscriber()
+    test_snapshot()
+    test_formats()
+    test_concurrency()
+    test_swiss()
     print "Success!  All tests pass!"
 
 